@@ -1,9 +1,53 @@
-import json
+import collections
+import os
+import queue
 import socket
+import sys
 import threading
 import time
 
-import cv2
+# OpenMP builds of OpenCV read this at import time
+NUM_THREADS = os.cpu_count() or 4
+os.environ.setdefault("OMP_NUM_THREADS", str(NUM_THREADS))
+
+import cv2  # noqa: E402
+import numpy as np  # noqa: E402
+
+# Let detectMultiScale use every core; some builds default to one thread
+cv2.setUseOptimized(True)
+cv2.setNumThreads(NUM_THREADS)
+
+# LBP cascade uses integer pixel comparisons and is several times faster than
+# Haar. The pip opencv-python wheels only bundle Haar cascades, so fall back to
+# those when the LBP file is not available.
+LBP_CASCADE = "lbpcascade_frontalface_improved.xml"
+HAAR_CASCADE = "haarcascade_frontalface_default.xml"
+
+# Resend the current status this often even if unchanged; the Pi drops the
+# connection when it hears nothing for twice this long
+HEARTBEAT_INTERVAL = 5.0
+
+# Run the cascade on every Nth frame; a face counts as present when detected
+# in at least FACE_VOTES of the last HISTORY_SIZE detections
+DETECT_EVERY = 3
+HISTORY_SIZE = 3
+FACE_VOTES = 2
+
+# Cascade parameters. Face sizes are in half-resolution detection pixels,
+# i.e. 80x80 to 400x400 in the full webcam frame, the range for a person
+# seated in front of the camera.
+SCALE_FACTOR = 1.2
+MIN_NEIGHBORS = 5
+MIN_FACE_SIZE = (40, 40)
+MAX_FACE_SIZE = (200, 200)
+
+# Requested webcam resolution
+FRAME_WIDTH = 640
+FRAME_HEIGHT = 480
+
+# Each status update is a single byte
+FACE_PRESENT = b"\x01"
+FACE_ABSENT = b"\x00"
 
 
 class FaceDetectionServer:
@@ -13,16 +57,112 @@ class FaceDetectionServer:
         self.socket = None
         self.client_socket = None
         self.running = False
+        self._last_sent = None
+        self._last_sent_time = 0.0
+        self._status_lock = threading.Lock()  # guards client_socket, _last_sent
+
+        # Single-slot "latest wins" queues between pipeline stages
+        self.frame_queue = queue.Queue(maxsize=1)
+        self.result_queue = queue.Queue(maxsize=1)
+        self.capture_thread = None
+        self.detection_thread = None
+
+        # Frame skipping and hysteresis state for the detection stage
+        self._frame_idx = 0
+        self._faces = []
+        self._history = collections.deque([False] * HISTORY_SIZE, maxlen=HISTORY_SIZE)
 
         # Initialize face detection
-        self.face_cascade = cv2.CascadeClassifier(
-            cv2.data.haarcascades + "haarcascade_frontalface_default.xml"
-        )
-        self.cap = cv2.VideoCapture(0)
+        self.face_cascade = self.load_cascade()
+        self.gpu_cascade = self.load_gpu_cascade()
+        self.gpu_frame = cv2.cuda_GpuMat() if self.gpu_cascade else None
+        self.cap = self.open_camera()
 
         if not self.cap.isOpened():
             raise Exception("Could not open webcam")
 
+        # Preallocate grayscale buffers reused by every detection call
+        width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self._gray = np.empty((height, width), dtype=np.uint8)
+        self._small = np.empty((height // 2, width // 2), dtype=np.uint8)
+
+    def open_camera(self):
+        """Open the webcam with MJPG frames and a one-frame buffer"""
+        if sys.platform.startswith("win"):
+            backend = cv2.CAP_DSHOW
+        elif sys.platform.startswith("linux"):
+            backend = cv2.CAP_V4L2
+        else:
+            backend = cv2.CAP_ANY
+
+        cap = cv2.VideoCapture(0, backend)
+
+        # MJPG needs less USB bandwidth than raw YUYV, and a single buffered
+        # frame keeps the status from lagging behind the camera
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*"MJPG"))
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_WIDTH)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_HEIGHT)
+        return cap
+
+    def load_cascade(self):
+        """Load the LBP face cascade, falling back to Haar if unavailable"""
+        lbp_dir = getattr(cv2.data, "lbpcascades", None) or os.path.join(
+            os.path.dirname(os.path.dirname(cv2.data.haarcascades)), "lbpcascades"
+        )
+        lbp_path = os.path.join(lbp_dir, LBP_CASCADE)
+        if os.path.exists(lbp_path):
+            cascade = cv2.CascadeClassifier(lbp_path)
+            if not cascade.empty():
+                print("Using LBP face cascade")
+                self.cascade_path = lbp_path
+                return cascade
+
+        print("LBP cascade not found, using Haar face cascade")
+        self.cascade_path = cv2.data.haarcascades + HAAR_CASCADE
+        return cv2.CascadeClassifier(self.cascade_path)
+
+    def get_gpu_cascade_path(self):
+        """Return a cascade file the CUDA classifier can load, or None"""
+        if os.path.basename(self.cascade_path) != HAAR_CASCADE:
+            return self.cascade_path
+
+        # The CUDA loader only accepts the old-format Haar files, which OpenCV
+        # ships in a separate haarcascades_cuda directory
+        cuda_dir = os.path.join(
+            os.path.dirname(os.path.dirname(cv2.data.haarcascades)),
+            "haarcascades_cuda",
+        )
+        cuda_path = os.path.join(cuda_dir, HAAR_CASCADE)
+        return cuda_path if os.path.exists(cuda_path) else None
+
+    def load_gpu_cascade(self):
+        """Load a CUDA face cascade if OpenCV was built with CUDA and a GPU exists"""
+        try:
+            if cv2.cuda.getCudaEnabledDeviceCount() == 0:
+                return None
+        except (AttributeError, cv2.error):
+            return None
+
+        gpu_cascade_path = self.get_gpu_cascade_path()
+        if gpu_cascade_path is None:
+            print("CUDA cascade skipped: old-format Haar cascade not found")
+            return None
+
+        try:
+            cascade = cv2.cuda_CascadeClassifier.create(gpu_cascade_path)
+        except (AttributeError, cv2.error) as e:
+            print(f"CUDA cascade skipped: {e}")
+            return None
+
+        cascade.setScaleFactor(SCALE_FACTOR)
+        cascade.setMinNeighbors(MIN_NEIGHBORS)
+        cascade.setMinObjectSize(MIN_FACE_SIZE)
+        cascade.setMaxObjectSize(MAX_FACE_SIZE)
+        print("Using CUDA face cascade")
+        return cascade
+
     def start_server(self):
         """Start the socket server to communicate with Raspberry Pi"""
         self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
@@ -31,41 +171,115 @@ class FaceDetectionServer:
         self.socket.listen(1)
         print(f"Server listening on {self.host}:{self.port}")
 
+        # Keep accepting so a Raspberry Pi that reconnects replaces the old client
         while self.running:
             try:
-                self.client_socket, addr = self.socket.accept()
+                client_socket, addr = self.socket.accept()
+                # Disable Nagle's algorithm so small status messages go out immediately
+                client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
                 print(f"Connected to Raspberry Pi at {addr}")
-                break
+
+                with self._status_lock:
+                    if self.client_socket:
+                        self.client_socket.close()
+                    self.client_socket = client_socket
+                    # Make sure the new client receives the current status
+                    self._last_sent = None
             except socket.error:
                 if self.running:
                     time.sleep(1)
 
-    def detect_faces(self):
-        """Detect faces and determine orientation"""
-        ret, frame = self.cap.read()
-        if not ret:
-            return None
+    def detect_faces(self, frame):
+        """Detect faces in a frame and return their rectangles"""
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=self._gray)
+
+        # Detect on a half-resolution copy; cascade cost scales with pixel count
+        small = cv2.resize(
+            gray,
+            (0, 0),
+            dst=self._small,
+            fx=0.5,
+            fy=0.5,
+            interpolation=cv2.INTER_AREA,
+        )
+        if self.gpu_cascade:
+            self.gpu_frame.upload(small)
+            faces_gpu = self.gpu_cascade.detectMultiScale(self.gpu_frame)
+            faces = self.gpu_cascade.convert(faces_gpu)
+            if faces is None:
+                faces = ()
+        else:
+            faces = self.face_cascade.detectMultiScale(
+                small,
+                SCALE_FACTOR,
+                MIN_NEIGHBORS,
+                minSize=MIN_FACE_SIZE,
+                maxSize=MAX_FACE_SIZE,
+            )
+
+        # Scale rectangles back up to the full-resolution frame
+        return [(x * 2, y * 2, w * 2, h * 2) for x, y, w, h in faces]
+
+    @staticmethod
+    def put_latest(q, item):
+        """Put an item into a single-slot queue, dropping any stale item"""
+        try:
+            q.get_nowait()
+        except queue.Empty:
+            pass
+        q.put_nowait(item)
+
+    def run_stage(self, name, stage):
+        """Run a pipeline stage, stopping the whole program if it fails"""
+        try:
+            stage()
+        except Exception as e:
+            print(f"{name} stage failed: {e}")
+            self.running = False
 
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        faces = self.face_cascade.detectMultiScale(gray, 1.1, 4)
+    def capture_frames(self):
+        """Capture stage: keep only the most recent webcam frame"""
+        while self.running:
+            ret, frame = self.cap.read()
+            if not ret:
+                time.sleep(0.01)
+                continue
+            self.put_latest(self.frame_queue, frame)
+
+    def process_frames(self):
+        """Detection stage: run face detection on every Nth frame"""
+        while self.running:
+            try:
+                frame = self.frame_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
 
-        # Show the camera feed with face detection rectangles
+            if self._frame_idx % DETECT_EVERY == 0:
+                self._faces = self.detect_faces(frame)
+                self._history.append(len(self._faces) > 0)
+            self._frame_idx += 1
+
+            # Person is facing the camera if most recent detections saw a face
+            face_detected = sum(self._history) >= FACE_VOTES
+            self.put_latest(self.result_queue, (frame, self._faces, face_detected))
+
+    def show_frame(self, frame, faces):
+        """Show the camera feed with face detection rectangles"""
         for x, y, w, h in faces:
             cv2.rectangle(frame, (x, y), (x + w, y + h), (255, 0, 0), 2)
 
         cv2.imshow("Face Detection - PC", frame)
 
-        # Return True if faces are detected (person facing camera)
-        return len(faces) > 0
-
     def send_status(self, face_detected):
         """Send face detection status to Raspberry Pi"""
         if self.client_socket:
             try:
-                message = json.dumps({"face_detected": face_detected})
-                self.client_socket.send((message + "\n").encode())
+                self.client_socket.sendall(
+                    FACE_PRESENT if face_detected else FACE_ABSENT
+                )
             except socket.error as e:
                 print(f"Error sending data: {e}")
+                self.client_socket.close()
                 self.client_socket = None
 
     def run(self):
@@ -77,6 +291,19 @@ class FaceDetectionServer:
         server_thread.daemon = True
         server_thread.start()
 
+        # Start capture and detection pipeline stages
+        self.capture_thread = threading.Thread(
+            target=self.run_stage, args=("Capture", self.capture_frames)
+        )
+        self.capture_thread.daemon = True
+        self.capture_thread.start()
+
+        self.detection_thread = threading.Thread(
+            target=self.run_stage, args=("Detection", self.process_frames)
+        )
+        self.detection_thread.daemon = True
+        self.detection_thread.start()
+
         print("Face detection started. Press 'q' to quit.")
         print(
             "Make sure your Raspberry Pi program is running and connects to this PC's IP address."
@@ -84,17 +311,28 @@ class FaceDetectionServer:
 
         try:
             while self.running:
-                face_detected = self.detect_faces()
+                try:
+                    frame, faces, face_detected = self.result_queue.get(timeout=0.01)
+                except queue.Empty:
+                    pass
+                else:
+                    self.show_frame(frame, faces)
 
-                if face_detected is not None:
-                    self.send_status(face_detected)
+                    # Only send on state changes, plus a periodic heartbeat
+                    now = time.monotonic()
+                    with self._status_lock:
+                        if (
+                            face_detected != self._last_sent
+                            or now - self._last_sent_time >= HEARTBEAT_INTERVAL
+                        ):
+                            self.send_status(face_detected)
+                            self._last_sent = face_detected
+                            self._last_sent_time = now
 
                 # Check for quit command
                 if cv2.waitKey(1) & 0xFF == ord("q"):
                     break
 
-                time.sleep(0.1)  # Small delay to prevent excessive CPU usage
-
         except KeyboardInterrupt:
             print("\nShutting down...")
         finally:
@@ -104,6 +342,11 @@ class FaceDetectionServer:
         """Clean up resources"""
         self.running = False
 
+        # Let pipeline stages finish before releasing the camera
+        for thread in (self.capture_thread, self.detection_thread):
+            if thread:
+                thread.join(timeout=1)
+
         if self.cap:
             self.cap.release()
 
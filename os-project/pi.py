@@ -1,14 +1,42 @@
-import json
+import collections
+import errno
+import hashlib
 import os
 import random
+import select
 import socket
-import threading
 import time
 import tkinter as tk
 from tkinter import messagebox
 
 from PIL import Image, ImageTk
 
+# Images are pre-resized to the screen size and cached on disk as PNGs, so Tk
+# can load them natively without Pillow
+CACHE_DIR = ".cache"
+
+# Memory budget for decoded PhotoImages (about 8 full-HD images at 4 bytes
+# per pixel); least recently used ones are dropped beyond this
+PHOTO_CACHE_BYTES = 64 * 1024 * 1024
+
+# Each status update is a single byte
+FACE_PRESENT = b"\x01"
+FACE_ABSENT = b"\x00"
+
+# The socket is polled from the Tk event loop instead of a reader thread
+POLL_INTERVAL_MS = 10
+RETRY_DELAY_MS = 5000
+
+# The PC resends its status every 5 seconds; treat the connection as dead if
+# nothing arrives for twice that long
+HEARTBEAT_TIMEOUT = 10.0
+CONNECT_IN_PROGRESS = {
+    0,
+    errno.EINPROGRESS,
+    errno.EWOULDBLOCK,
+    getattr(errno, "WSAEWOULDBLOCK", errno.EWOULDBLOCK),
+}
+
 
 class DisplayController:
     def __init__(self, pc_ip, port=12345, memes_folder="memes", slides_folder="slides"):
@@ -40,10 +68,27 @@ class DisplayController:
         self.current_mode = None  # 'memes' or 'slides'
         self.current_images = []
         self.current_image_index = 0
-        self.slide_timer = None
+        self.slide_after_id = None
+        self.socket_after_id = None
         self.socket = None
+        self.recv_buffer = bytearray(4096)  # reused by every socket read
+        self.last_status = None
+        self.last_receive_time = 0.0
+        self.rng = random.Random()
+        # Least recently used PhotoImages for the current window size
+        self.photo_cache = collections.OrderedDict()  # image_path -> PhotoImage
+        self.photo_cache_size = None
+        self.photo_cache_bytes = 0
+        self.image_names = {}  # cached image path -> original file name
+        self.image_sizes = {}  # cached image path -> (width, height)
         self.connected = False
 
+        # Pre-resized images match the full screen, as used in fullscreen mode
+        self.display_size = (
+            self.root.winfo_screenwidth(),
+            self.root.winfo_screenheight(),
+        )
+
         # Load available images
         self.load_images()
 
@@ -53,8 +98,16 @@ class DisplayController:
 
     def load_images(self):
         """Load available images from both folders"""
-        self.memes = self.get_image_files(self.memes_folder)
-        self.slides = self.get_image_files(self.slides_folder)
+        self.memes = self.precompute_images(self.get_image_files(self.memes_folder))
+        self.slides = self.precompute_images(
+            self.get_image_files(self.slides_folder)
+        )
+        self.prune_cache(self.memes_folder, self.memes)
+        self.prune_cache(self.slides_folder, self.slides)
+
+        # Memes are shown in shuffled rotation so none repeats back-to-back
+        self.meme_queue = collections.deque(self.memes)
+        self.rng.shuffle(self.meme_queue)
 
         print(f"Loaded {len(self.memes)} memes and {len(self.slides)} slides")
 
@@ -69,42 +122,158 @@ class DisplayController:
         images = []
 
         if os.path.exists(folder):
-            for file in os.listdir(folder):
-                if any(file.lower().endswith(ext) for ext in image_extensions):
-                    images.append(os.path.join(folder, file))
+            # scandir reports file types from the directory entry, avoiding a
+            # stat per file on slow SD cards
+            with os.scandir(folder) as entries:
+                for entry in entries:
+                    ext = os.path.splitext(entry.name)[1].lower()
+                    if ext in image_extensions and entry.is_file():
+                        images.append(entry.path)
+
+        return sorted(images)
+
+    def precompute_images(self, image_paths):
+        """Return paths to copies of the images pre-resized to the screen"""
+        return [self.get_cached_image(path) for path in image_paths]
+
+    def get_cached_image(self, image_path):
+        """Resize an image once and save it in the folder's cache directory"""
+        cache_dir = os.path.join(os.path.dirname(image_path), CACHE_DIR)
+        width, height = self.display_size
+        tmp_path = None
 
-        return images
-
-    def display_image(self, image_path):
-        """Display an image on the screen"""
         try:
-            # Open and resize image to fit screen
-            image = Image.open(image_path)
+            # Include the modification time and size so edited images and
+            # screen changes get re-cached
+            mtime = os.path.getmtime(image_path)
+            key = f"{os.path.abspath(image_path)}:{mtime}:{width}x{height}"
+            digest = hashlib.sha1(key.encode()).hexdigest()
+            cache_path = os.path.join(cache_dir, f"{digest}_{width}x{height}.png")
+
+            if not os.path.exists(cache_path):
+                os.makedirs(cache_dir, exist_ok=True)
+                image = Image.open(image_path)
+                if image.mode not in ("RGB", "RGBA", "L", "LA"):
+                    # Keep transparency; palette images would also only
+                    # get nearest-neighbour resampling
+                    transparent = (
+                        "A" in image.getbands() or "transparency" in image.info
+                    )
+                    image = image.convert("RGBA" if transparent else "RGB")
+                image.thumbnail(self.display_size, Image.Resampling.LANCZOS)
+                # Write to a temporary file first so an interrupted save never
+                # leaves a truncated PNG at cache_path. Low compression keeps
+                # decoding fast on the Pi.
+                tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+                image.save(tmp_path, format="PNG", compress_level=1)
+                os.replace(tmp_path, cache_path)
+                cached_size = image.size
+            else:
+                # Only reads the PNG header
+                with Image.open(cache_path) as image:
+                    cached_size = image.size
+        except Exception as e:
+            print(f"Error caching image {image_path}: {e}")
+            if tmp_path and os.path.exists(tmp_path):
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+            return image_path
+
+        self.image_names[cache_path] = os.path.basename(image_path)
+        self.image_sizes[cache_path] = cached_size
+        return cache_path
+
+    def prune_cache(self, folder, images):
+        """Remove cached copies that no longer belong to any image"""
+        cache_dir = os.path.join(folder, CACHE_DIR)
+        if not os.path.isdir(cache_dir):
+            return
+
+        keep = set(images)
+        with os.scandir(cache_dir) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.path not in keep:
+                    try:
+                        os.remove(entry.path)
+                    except OSError as e:
+                        print(f"Error removing cached image {entry.path}: {e}")
 
-            # Get screen dimensions
-            screen_width = self.root.winfo_width()
-            screen_height = self.root.winfo_height()
+    def get_screen_size(self):
+        """Get the current window dimensions"""
+        screen_width = self.root.winfo_width()
+        screen_height = self.root.winfo_height()
 
-            if screen_width <= 1 or screen_height <= 1:
-                screen_width, screen_height = 800, 600
+        if screen_width <= 1 or screen_height <= 1:
+            screen_width, screen_height = 800, 600
+
+        return screen_width, screen_height
+
+    def prefetch_image(self, image_path):
+        """Decode an image into the photo cache ahead of displaying it"""
+        try:
+            self.get_photo(image_path, self.get_screen_size())
+        except Exception as e:
+            print(f"Error prefetching image {image_path}: {e}")
+
+    @staticmethod
+    def photo_bytes(photo):
+        """Approximate memory held by a decoded PhotoImage"""
+        return photo.width() * photo.height() * 4
+
+    def get_photo(self, image_path, size):
+        """Return a PhotoImage resized to fit size, decoding it only once"""
+        if size != self.photo_cache_size:
+            # Cached photos were resized for the old window size
+            self.photo_cache.clear()
+            self.photo_cache_size = size
+            self.photo_cache_bytes = 0
+
+        photo = self.photo_cache.get(image_path)
+        if photo is not None:
+            self.photo_cache.move_to_end(image_path)
+            return photo
+
+        cached_size = self.image_sizes.get(image_path)
+        if cached_size and cached_size[0] <= size[0] and cached_size[1] <= size[1]:
+            # Cached copy already fits, let Tk decode it directly
+            photo = tk.PhotoImage(file=image_path)
+        else:
+            image = Image.open(image_path)
 
             # Resize image while maintaining aspect ratio
-            image.thumbnail((screen_width, screen_height), Image.Resampling.LANCZOS)
+            image.thumbnail(size, Image.Resampling.LANCZOS)
 
             # Convert to PhotoImage
             photo = ImageTk.PhotoImage(image)
 
+        # Evict least recently used photos, always keeping the newest one
+        self.photo_cache[image_path] = photo
+        self.photo_cache_bytes += self.photo_bytes(photo)
+        while (
+            self.photo_cache_bytes > PHOTO_CACHE_BYTES and len(self.photo_cache) > 1
+        ):
+            _, evicted = self.photo_cache.popitem(last=False)
+            self.photo_cache_bytes -= self.photo_bytes(evicted)
+
+        return photo
+
+    def display_image(self, image_path):
+        """Display an image on the screen"""
+        name = self.image_names.get(image_path, os.path.basename(image_path))
+        try:
+            photo = self.get_photo(image_path, self.get_screen_size())
+
             # Update label
             self.image_label.config(image=photo)
             self.image_label.image = photo  # Keep a reference
 
-            print(f"Displaying: {os.path.basename(image_path)}")
+            print(f"Displaying: {name}")
 
         except Exception as e:
             print(f"Error displaying image {image_path}: {e}")
-            self.show_error_message(
-                f"Cannot display image: {os.path.basename(image_path)}"
-            )
+            self.show_error_message(f"Cannot display image: {name}")
 
     def show_error_message(self, message):
         """Show error message on screen"""
@@ -122,14 +291,16 @@ class DisplayController:
         self.current_image_index = 0
 
         # Stop slide timer if running
-        if self.slide_timer:
-            self.slide_timer.cancel()
-            self.slide_timer = None
+        self.cancel_slide_timer()
 
-        if self.current_images:
-            # Show random meme
-            random_meme = random.choice(self.current_images)
-            self.display_image(random_meme)
+        if self.meme_queue:
+            # Show the next meme in the shuffled rotation
+            meme = self.meme_queue[0]
+            self.meme_queue.rotate(-1)
+            self.display_image(meme)
+
+            # Decode the following meme once Tk is idle so the next switch is instant
+            self.root.after_idle(self.prefetch_image, self.meme_queue[0])
         else:
             self.show_error_message("No memes available!\nAdd images to 'memes' folder")
 
@@ -163,64 +334,109 @@ class DisplayController:
             self.current_images
         )
 
-        # Schedule next slide (5 seconds interval)
-        self.slide_timer = threading.Timer(5.0, self.show_next_slide)
-        self.slide_timer.start()
+        # Schedule next slide (5 seconds interval) on the Tk event loop
+        self.slide_after_id = self.root.after(5000, self.show_next_slide)
 
-    def connect_to_pc(self):
-        """Connect to PC and listen for face detection data"""
-        while True:
+    def cancel_slide_timer(self):
+        """Cancel the pending slide change, if any"""
+        if self.slide_after_id:
             try:
-                print(f"Attempting to connect to PC at {self.pc_ip}:{self.port}")
-                self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self.socket.connect((self.pc_ip, self.port))
-                self.connected = True
-                print("Connected to PC successfully!")
-
-                # Listen for messages
-                buffer = ""
-                while self.connected:
+                self.root.after_cancel(self.slide_after_id)
+            except tk.TclError:
+                pass  # Window already destroyed
+            self.slide_after_id = None
+
+    def connect_to_pc(self):
+        """Start a non-blocking connection to the PC"""
+        self.socket_after_id = None
+        print(f"Attempting to connect to PC at {self.pc_ip}:{self.port}")
+        try:
+            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self.socket.setblocking(False)
+            err = self.socket.connect_ex((self.pc_ip, self.port))
+            if err not in CONNECT_IN_PROGRESS:
+                raise OSError(err, os.strerror(err))
+        except OSError as e:
+            self.handle_disconnect(e)
+        finally:
+            # Keep polling unless a reconnection has been scheduled instead
+            if self.socket_after_id is None:
+                self.socket_after_id = self.root.after(
+                    POLL_INTERVAL_MS, self.pump_socket
+                )
+
+    def pump_socket(self):
+        """Poll the socket for connection completion and status messages"""
+        self.socket_after_id = None
+        try:
+            if not self.connected:
+                # Wait until the non-blocking connect has completed. Windows
+                # reports a failed connect in the exception set.
+                _, writable, failed = select.select(
+                    [], [self.socket], [self.socket], 0
+                )
+                if writable or failed:
+                    err = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                    if failed and not err:
+                        err = errno.ECONNREFUSED
+                    if err:
+                        raise OSError(err, os.strerror(err))
+                    self.socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                    self.connected = True
+                    self.last_receive_time = time.monotonic()
+                    print("Connected to PC successfully!")
+            else:
+                # Drain everything available; only the latest status matters
+                status = None
+                while True:
                     try:
-                        data = self.socket.recv(1024).decode()
-                        if not data:
-                            break
-
-                        buffer += data
-                        while "\n" in buffer:
-                            line, buffer = buffer.split("\n", 1)
-                            if line:
-                                self.process_message(line)
-
-                    except socket.error as e:
-                        print(f"Socket error: {e}")
+                        size = self.socket.recv_into(self.recv_buffer)
+                    except BlockingIOError:
                         break
+                    if not size:
+                        raise ConnectionError("Connection closed by PC")
+                    status = self.recv_buffer[size - 1]
+                    self.last_receive_time = time.monotonic()
+
+                if time.monotonic() - self.last_receive_time > HEARTBEAT_TIMEOUT:
+                    raise TimeoutError("No status received from PC")
+
+                # Only dispatch on state transitions
+                if status is not None and status != self.last_status:
+                    self.last_status = status
+                    self.process_message(bytes((status,)))
+        except OSError as e:
+            self.handle_disconnect(e)
+        finally:
+            # Keep polling unless a reconnection has been scheduled instead
+            if self.socket_after_id is None:
+                self.socket_after_id = self.root.after(
+                    POLL_INTERVAL_MS, self.pump_socket
+                )
+
+    def handle_disconnect(self, error):
+        """Close the socket and schedule a reconnection attempt"""
+        print(f"Connection error: {error}")
+        self.connected = False
+        self.last_status = None
 
-            except Exception as e:
-                print(f"Connection error: {e}")
-                self.connected = False
-
-                if self.socket:
-                    self.socket.close()
-                    self.socket = None
+        if self.socket:
+            self.socket.close()
+            self.socket = None
 
-                print("Retrying connection in 5 seconds...")
-                time.sleep(5)
+        print("Retrying connection in 5 seconds...")
+        self.socket_after_id = self.root.after(RETRY_DELAY_MS, self.connect_to_pc)
 
     def process_message(self, message):
         """Process incoming message from PC"""
-        try:
-            data = json.loads(message)
-            face_detected = data.get("face_detected", False)
-
-            if face_detected:
-                # Person is facing the camera - show memes
-                self.root.after(0, self.switch_to_memes)
-            else:
-                # Person is facing away - show slides
-                self.root.after(0, self.switch_to_slides)
-
-        except json.JSONDecodeError as e:
-            print(f"Error parsing message: {e}")
+        if message == FACE_PRESENT:
+            # Person is facing the camera - show memes
+            self.switch_to_memes()
+        elif message == FACE_ABSENT:
+            # Person is facing away - show slides
+            self.switch_to_slides()
+        else:
+            print(f"Unknown message: {message!r}")
 
     def exit_fullscreen(self, event=None):
         """Exit fullscreen mode"""
@@ -235,22 +451,27 @@ class DisplayController:
         """Clean up resources"""
         self.connected = False
 
-        if self.slide_timer:
-            self.slide_timer.cancel()
+        self.cancel_slide_timer()
+
+        if self.socket_after_id:
+            try:
+                self.root.after_cancel(self.socket_after_id)
+            except tk.TclError:
+                pass  # Window already destroyed
+            self.socket_after_id = None
 
         if self.socket:
             self.socket.close()
+            self.socket = None
 
     def run(self):
         """Start the application"""
-        # Start connection thread
-        connection_thread = threading.Thread(target=self.connect_to_pc)
-        connection_thread.daemon = True
-        connection_thread.start()
-
         # Show initial message
         self.show_error_message("Connecting to PC...")
 
+        # Connect and poll the socket from the Tk event loop
+        self.connect_to_pc()
+
         # Start GUI
         try:
             self.root.mainloop()